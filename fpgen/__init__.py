@@ -7,7 +7,6 @@ def __check_module__() -> None:
     '''
     Detect if fpgen is being ran as a module.
     '''
-    import inspect
     import os
     import sys
 
@@ -16,15 +15,17 @@ def __check_module__() -> None:
         os.environ['FPGEN_NO_INIT'] = '1'
         return
 
-    stack: list = inspect.stack(2)
-    if len(stack) >= 2:
-        prev, launch = stack[-2:]
-        try:
-            if (launch.function, prev.function) == ('_run_module_as_main', '_get_module_details'):
-                # Enable "partial execution mode" to prevent automatic downloads, starting network, etc.
-                os.environ['FPGEN_NO_INIT'] = '1'
-        except AttributeError:
-            pass
+    # Walk up to the two outermost frames.
+    # Cheaper than inspect.stack(), which also reads source lines for every frame.
+    prev, launch = None, sys._getframe()
+    while launch.f_back is not None:
+        prev, launch = launch, launch.f_back
+    if prev is not None and (launch.f_code.co_name, prev.f_code.co_name) == (
+        '_run_module_as_main',
+        '_get_module_details',
+    ):
+        # Enable "partial execution mode" to prevent automatic downloads, starting network, etc.
+        os.environ['FPGEN_NO_INIT'] = '1'
 
 
 __check_module__()
@@ -1,11 +1,13 @@
 import heapq
 import random
+import sys
+from bisect import bisect_right
+from itertools import accumulate
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
+from typing import Any, Container, Dict, Iterable, List, Mapping, Optional, Set, Tuple, Union
 
 from .exceptions import RestrictiveConstraints
 from .pkgman import extract_json
-from .structs import CaseInsensitiveDict
 from .unpacker import lookup_value_list
 
 StrContainer = Union[str, List[str], Tuple[str, ...], Set[str]]
@@ -14,6 +16,9 @@ StrContainer = Union[str, List[str], Tuple[str, ...], Set[str]]
 # This cuts off values that are way too low or contaminated
 BEAM_WIDTH = 1000
 
+# Max number of node orderings trace() keeps. It's cleared once full
+TRACE_ORDER_CACHE_SIZE = 128
+
 
 class BayesianNode:
     """
@@ -27,31 +32,100 @@ class BayesianNode:
         'possible_values',
         'probabilities',
         'index',
+        'parent_indices',
+        '_cpt_cache',
+        '_max_probability',
+        '_value_to_parent_paths',
+        '_uniform_probabilities',
     )
 
     def __init__(self, node_definition: Dict[str, Any], index: int):
         # Node defintion info
         self.node_definition = node_definition
-        self.name = node_definition['name']
-        self.parent_names = node_definition['parentNames']
-        self.possible_values = node_definition['possibleValues']
+        # Names are interned, so name lookups can match by identity
+        self.name = sys.intern(node_definition['name'])
+        self.parent_names = list(map(sys.intern, node_definition['parentNames']))
+        # Interned, so equal values across nodes & evidence share one object
+        self.possible_values: Tuple[str, ...] = tuple(
+            map(sys.intern, node_definition['possibleValues'])
+        )
         # CPT data structure
         self.probabilities = node_definition['conditionalProbabilities']
         # Index in the sampling order
         self.index = index
+        # Indexes of the parent nodes (set by the network)
+        self.parent_indices: Tuple[int, ...] = ()
+        # CPT rows that have already been looked up, keyed by parent values
+        self._cpt_cache: Dict[Tuple[Any, ...], Dict[Any, float]] = {}
+        # Upper bound of the probabilities in the CPT (computed on first use)
+        self._max_probability: Optional[float] = None
+        # Reverse index of the CPT (computed on first use)
+        self._value_to_parent_paths: Optional[Dict[str, List[Tuple[str, ...]]]] = None
+        # Fallback distribution for CPT rows that are missing (computed on first use)
+        self._uniform_probabilities: Optional[Dict[str, float]] = None
 
     def get_probabilities_given_known_values(
-        self, parent_values: Mapping[str, Any]
+        self, parent_values: Tuple[Any, ...]
     ) -> Dict[Any, float]:
         """
         Extracts the probabilities for this node's values, given known parent values
+        (ordered the same as parent_names)
         """
+        probabilities = self._cpt_cache.get(parent_values)
+        if probabilities is not None:
+            return probabilities
+
         probabilities = self.probabilities
-        for parent_name in self.parent_names:
-            parent_value = parent_values[parent_name]
+        for parent_value in parent_values:
             probabilities = probabilities.get(parent_value, {})
+        self._cpt_cache[parent_values] = probabilities
         return probabilities
 
+    @property
+    def max_probability(self) -> float:
+        """
+        The highest probability this node can assign to a value, given any parent values
+        """
+        if self._max_probability is None:
+            # Collect the CPT rows at the depth of the parents
+            rows = [self.probabilities]
+            for _ in self.parent_names:
+                rows = [row for parent_row in rows for row in parent_row.values()]
+            max_probability = max((p for row in rows for p in row.values()), default=0.0)
+            # Missing CPT rows fall back to a uniform distribution
+            if self.possible_values:
+                max_probability = max(max_probability, 1.0 / len(self.possible_values))
+            self._max_probability = max_probability
+        return self._max_probability
+
+    @property
+    def uniform_probabilities(self) -> Dict[str, float]:
+        """
+        Uniform distribution over this node's possible values
+        """
+        if self._uniform_probabilities is None:
+            if self.possible_values:
+                uniform_prob = 1.0 / len(self.possible_values)
+                self._uniform_probabilities = {val: uniform_prob for val in self.possible_values}
+            else:
+                self._uniform_probabilities = {}
+        return self._uniform_probabilities
+
+    @property
+    def value_to_parent_paths(self) -> Dict[str, List[Tuple[str, ...]]]:
+        """
+        Maps each value to the parent value paths in the CPT that lead to it
+        """
+        if self._value_to_parent_paths is None:
+            self._value_to_parent_paths = collect_parent_paths(
+                self.probabilities, len(self.parent_names)
+            )
+        return self._value_to_parent_paths
+
+
+# Nodes to expand in trace(), each with the beam positions of its parents
+TraceSteps = List[Tuple[BayesianNode, Tuple[int, ...]]]
+
 
 class BayesianNetwork:
     """
@@ -65,13 +139,27 @@ class BayesianNetwork:
             for index, node_def in enumerate(network_definition['nodes'])
         ]
         nodes_by_name = {node.name: node for node in self.nodes_in_sampling_order}
-        self.nodes_by_name = CaseInsensitiveDict(nodes_by_name)
+        # Nodes keyed by their casefolded name. Callers casefold the name themselves.
+        self.nodes_by_name: Dict[str, BayesianNode] = {
+            sys.intern(name.casefold()): node for name, node in nodes_by_name.items()
+        }
         # Keep a list of the original names
         self.node_names = tuple(nodes_by_name.keys())
-        # Precompute ancestors
-        self.ancestors_by_name: Dict[str, Set[str]] = {}
+        # Sorted casefolded names, for prefix searches
+        self._sorted_node_names = sorted(self.nodes_by_name.keys())
+        # Precompute the ancestors of each node as a bitmask of node indexes.
+        # Parents always come before their children in the sampling order.
+        self.ancestor_masks: List[int] = []
         for node in self.nodes_in_sampling_order:
-            self.get_all_ancestors(node.name)
+            node.parent_indices = tuple(nodes_by_name[parent].index for parent in node.parent_names)
+            mask = 0
+            for parent_index in node.parent_indices:
+                mask |= (1 << parent_index) | self.ancestor_masks[parent_index]
+            self.ancestor_masks.append(mask)
+        # Ancestor sets, built from the masks on request
+        self.ancestors_by_name: Dict[str, Set[str]] = {}
+        # trace() node orderings, keyed by the bitmask of relevant nodes
+        self._trace_orders: Dict[int, Tuple[TraceSteps, Dict[str, int]]] = {}
 
     def generate_consistent_sample(
         self, evidence: Mapping[str, Set[str]]
@@ -80,8 +168,8 @@ class BayesianNetwork:
         Generate a full sample from the Bayesian network.
         """
         result: Dict[str, str] = {}
-        # Create a working copy of evidence that we can update in place.
-        current_evidence = {k: set(v) for k, v in evidence.items()}
+        # Working copy of evidence. Sampled nodes are stored as bare values, not sets.
+        current_evidence: Dict[str, Union[str, Set[str]]] = dict(evidence)
 
         for node in self.nodes_in_sampling_order:
             node_name = node.name
@@ -93,12 +181,11 @@ class BayesianNetwork:
                 distribution = self.trace(node_name, search_evidence)
 
                 # Filter the distribution to allowed values and renormalize.
-                filtered_dist = {k: v for k, v in distribution.items() if k in allowed_values}
-                if not filtered_dist or sum(filtered_dist.values()) <= 0:
+                filtered_dist, total = filter_distribution(distribution, allowed_values)
+                if total <= 0:
                     uniform_prob = 1.0 / len(allowed_values)
                     filtered_dist = {val: uniform_prob for val in allowed_values}
                 else:
-                    total = sum(filtered_dist.values())
                     filtered_dist = {k: v / total for k, v in filtered_dist.items()}
                 sampled_value = self.sample_value_from_distribution(filtered_dist)
             else:
@@ -108,7 +195,7 @@ class BayesianNetwork:
 
             result[node_name] = sampled_value
             # Update current evidence with the newly sampled node value.
-            current_evidence[node_name] = {sampled_value}
+            current_evidence[node_name] = sampled_value
 
         return result
 
@@ -136,16 +223,15 @@ class BayesianNetwork:
                 allowed_values = evidence[target_node]
 
                 # Filter and renormalize
-                filtered_dist = {k: v for k, v in distribution.items() if k in allowed_values}
+                filtered_dist, total = filter_distribution(distribution, allowed_values)
 
                 # If no probability mass, use uniform distribution over allowed values
-                if not filtered_dist or sum(filtered_dist.values()) <= 0:
+                if total <= 0:
                     raise RestrictiveConstraints(
                         f"Cannot generate fingerprint: No valid values for {target_node} with current conditions."
                     )
 
                 # Renormalize
-                total = sum(filtered_dist.values())
                 filtered_dist = {k: v / total for k, v in filtered_dist.items()}
 
                 distribution = filtered_dist
@@ -206,16 +292,8 @@ class BayesianNetwork:
         if node_name in self.ancestors_by_name:
             return self.ancestors_by_name[node_name]
 
-        node = self.nodes_by_name[node_name]
-        ancestors: Set[str] = set()
-        if not node:
-            return ancestors
-
-        # Add direct parents
-        for parent in node.parent_names:
-            ancestors.add(parent)
-            # Add parent's ancestors recursively
-            ancestors.update(self.get_all_ancestors(parent))
+        mask = self.ancestor_masks[self.nodes_by_name[node_name.casefold()].index]
+        ancestors = {node.name for node in self.nodes_in_sampling_order if mask >> node.index & 1}
 
         self.ancestors_by_name[node_name] = ancestors
         return ancestors
@@ -225,95 +303,142 @@ class BayesianNetwork:
         Calculate conditional probability distribution for target given evidence
         using beam search.
         """
-        # Get the actual target name and build relevant nodes set.
-        target = self.nodes_by_name[target].name
-        relevant_nodes = self.get_all_ancestors(target).copy()
-        relevant_nodes.add(target)
+        # Get the actual target name and build a bitmask of the relevant nodes.
+        nodes_by_name = self.nodes_by_name
+        target_node = nodes_by_name[target.casefold()]
+        target = target_node.name
+        relevant_mask = self.ancestor_masks[target_node.index] | (1 << target_node.index)
 
         # Add evidence nodes and their ancestors.
         for ev_node in evidence:
-            if ev_node in self.nodes_by_name:
-                relevant_nodes.add(ev_node)
-                relevant_nodes.update(self.get_all_ancestors(ev_node))
-
-        # Sort nodes by sampling order
-        ordered_nodes = [
-            node for node in self.nodes_in_sampling_order if node.name in relevant_nodes
-        ]
-
-        # Initialize beam
-        beam: List[Tuple[Dict[str, Any], float]] = [({}, 1.0)]
-        # Local cache for conditional probability lookups
-        cpt_cache: Dict[Tuple[str, Tuple[Any, ...]], Dict[Any, float]] = {}
-
-        for node in ordered_nodes:
-            new_beam = []
+            ev_node_obj = nodes_by_name.get(ev_node.casefold())
+            if ev_node_obj is not None:
+                ev_index = ev_node_obj.index
+                relevant_mask |= self.ancestor_masks[ev_index] | (1 << ev_index)
+
+        trace_steps, positions = self._get_trace_order(relevant_mask)
+
+        # Initialize beam.
+        # Entries are (probability, order, assignment). `order` counts down as entries
+        # are added, so earlier entries win ties, and assignments are never compared.
+        beam: List[Tuple[float, int, Tuple[Any, ...]]] = [(1.0, 0, ())]
+        # Whether the beam is sorted by probability (descending)
+        beam_is_sorted = True
+        # Local bindings for the inner loop
+        heapreplace = heapq.heapreplace
+        beam_width = BEAM_WIDTH
+
+        for node, parent_positions in trace_steps:
+            new_beam: List[Tuple[float, int, Tuple[Any, ...]]] = []
+            append = new_beam.append
+            # Whether new_beam has been turned into a min-heap of BEAM_WIDTH entries
+            is_heap = False
+            order = 0
             node_name = node.name
 
             # Determine allowed values from evidence if present
             allowed_values = evidence[node_name] if node_name in evidence else None
+            # A bare value fixes the node to that value
+            if isinstance(allowed_values, str):
+                allowed_values = (allowed_values,)
+            max_probability = node.max_probability
+            get_cpt = node.get_probabilities_given_known_values
 
             # Process each assignment in the current beam
-            for assignment, prob in beam:
+            for prob, _, assignment in beam:
+                # Once the beam is full, skip assignments that can't beat its lowest entry.
+                # If the beam is sorted, none of the remaining assignments can either.
+                if is_heap and prob * max_probability <= new_beam[0][0]:
+                    if beam_is_sorted:
+                        break
+                    continue
+
                 # Parent order is defined by node.parent_names
-                try:
-                    parent_values_tuple = tuple(assignment[parent] for parent in node.parent_names)
-                except KeyError:
-                    # Should not occur if assignments are built in order
-                    parent_values_tuple = ()
-
-                cache_key = (node_name, parent_values_tuple)
-                if cache_key in cpt_cache:
-                    cpt = cpt_cache[cache_key]
-                else:
-                    parent_values = {parent: assignment[parent] for parent in node.parent_names}
-                    cpt = node.get_probabilities_given_known_values(parent_values)
-                    # Use uniform distribution if missing
-                    if not cpt and node.possible_values:
-                        uniform_prob = 1.0 / len(node.possible_values)
-                        cpt = {val: uniform_prob for val in node.possible_values}
+                parent_values_tuple = tuple(assignment[n] for n in parent_positions)
+
+                cpt = get_cpt(parent_values_tuple)
+                # Use uniform distribution if missing
+                if not cpt:
+                    cpt = node.uniform_probabilities
 
                 # Expand the beam with new assignments
                 for value, p in cpt.items():
-                    if (allowed_values is None or value in allowed_values) and p > 0:
-                        # Create a new assignment with the new node value
-                        new_assignment = assignment.copy()
-                        new_assignment[node_name] = value
-                        new_beam.append((new_assignment, prob * p))
-
-            # Prune the beam if no valid configurations are left
-            if new_beam:
-                if len(new_beam) > BEAM_WIDTH:
-                    # Get the top BEAM_WIDTH assignments
-                    beam = heapq.nlargest(BEAM_WIDTH, new_beam, key=lambda x: x[1])
-                else:
-                    beam = new_beam
-            else:
+                    if (allowed_values is not None and value not in allowed_values) or p <= 0:
+                        continue
+                    new_prob = prob * p
+                    if not is_heap and len(new_beam) < beam_width:
+                        append((new_prob, order, assignment + (value,)))
+                    else:
+                        # The beam is full. Only keep assignments that beat the lowest one
+                        if not is_heap:
+                            heapq.heapify(new_beam)
+                            is_heap = True
+                        if new_prob <= new_beam[0][0]:
+                            continue
+                        heapreplace(new_beam, (new_prob, order, assignment + (value,)))
+                    order -= 1
+
+            # Stop if no valid configurations are left
+            if not new_beam:
                 return {}
+            # Pruned beams are kept sorted by probability
+            if is_heap:
+                new_beam.sort(reverse=True)
+            beam = new_beam
+            beam_is_sorted = is_heap
 
         # Extract the target distribution
         target_dist: Dict[str, float] = {}
         total_prob = 0.0
-        for assignment, prob in beam:
-            if target in assignment:
-                value = assignment[target]
-                target_dist[value] = target_dist.get(value, 0) + prob
-                total_prob += prob
+        target_position = positions[target]
+        for prob, _, assignment in beam:
+            value = assignment[target_position]
+            target_dist[value] = target_dist.get(value, 0) + prob
+            total_prob += prob
 
         if total_prob > 0:
             return {val: p / total_prob for val, p in target_dist.items()}
         return {}
 
+    def _get_trace_order(self, relevant_mask: int) -> Tuple[TraceSteps, Dict[str, int]]:
+        """
+        Get the relevant nodes in sampling order with the positions of their parents,
+        and each node's position in that order
+        """
+        if relevant_mask in self._trace_orders:
+            return self._trace_orders[relevant_mask]
+
+        # Sort nodes by sampling order
+        ordered_nodes = [
+            node for node in self.nodes_in_sampling_order if relevant_mask >> node.index & 1
+        ]
+        # Assignments are tuples of values, in the same order as ordered_nodes.
+        # Extending a tuple is much cheaper than copying a dict for every expansion.
+        positions = {node.name: n for n, node in enumerate(ordered_nodes)}
+        # Ancestors are always relevant too, so every parent has a position
+        index_positions = {node.index: n for n, node in enumerate(ordered_nodes)}
+        trace_steps = [
+            (node, tuple(index_positions[parent] for parent in node.parent_indices))
+            for node in ordered_nodes
+        ]
+
+        # Each set of target & evidence nodes gets its own ordering, so keep it bounded
+        if len(self._trace_orders) >= TRACE_ORDER_CACHE_SIZE:
+            self._trace_orders.clear()
+        self._trace_orders[relevant_mask] = trace_steps, positions
+        return trace_steps, positions
+
     def sample_value_from_distribution(self, distribution: Mapping[str, float]) -> str:
         """
         Sample a value from a probability distribution
         """
         anchor = random.random()  # nosec
-        cumulative_probability = 0.0
-        for value, probability in distribution.items():
-            cumulative_probability += probability
-            if anchor < cumulative_probability:
-                return value
+        values = tuple(distribution.keys())
+        cumulative = list(accumulate(distribution.values()))
+        # Find the first value whose cumulative probability exceeds the anchor
+        index = bisect_right(cumulative, anchor)
+        if index < len(values):
+            return values[index]
         # Fall back to first value
         return next(iter(distribution.keys()))
 
@@ -336,29 +461,27 @@ class BayesianNetwork:
             # Filter by allowed values and renormalize
             if node.name in evidence:
                 allowed_values = evidence[node.name]
-                filtered_dist = {k: v for k, v in distribution.items() if k in allowed_values}
+                filtered_dist, total = filter_distribution(distribution, allowed_values)
 
                 # If no probability mass, the conditions are impossible
-                if not filtered_dist or sum(filtered_dist.values()) <= 0:
+                if total <= 0:
                     raise RestrictiveConstraints(
                         f"Cannot generate fingerprint: no valid values for {node.name} with current conditions"
                     )
 
                 # Renormalize
-                total = sum(filtered_dist.values())
                 filtered_dist = {k: v / total for k, v in filtered_dist.items()}
                 return filtered_dist
 
             return distribution
 
         # For regular nodes, use direct sampling
-        parent_values = {parent: sample[parent] for parent in node.parent_names}
+        parent_values = tuple(sample[parent] for parent in node.parent_names)
 
         cpt = node.get_probabilities_given_known_values(parent_values)
-        if not cpt and node.possible_values:
+        if not cpt:
             # If missing probabilities, use uniform distribution
-            uniform_prob = 1.0 / len(node.possible_values)
-            cpt = {v: uniform_prob for v in node.possible_values}
+            cpt = node.uniform_probabilities
 
         if not cpt:
             raise RestrictiveConstraints(
@@ -410,62 +533,71 @@ class BayesianNetwork:
         """
         Intersect possible parent values based on child node conditions
         """
-        node_obj = self.nodes_by_name.get(node)
-        if not node_obj:
-            return
-
-        parent_names = node_obj.parent_names
-        num_parents = len(parent_names)
+        first_node_name = self.nodes_in_sampling_order[0].name
+        # Walk up through each node's first parent
+        while True:
+            node_obj = self.nodes_by_name.get(node.casefold())
+            if not node_obj:
+                return
+
+            parent_names = node_obj.parent_names
+            num_parents = len(parent_names)
+
+            # No parents exist, nothing to do
+            if not num_parents:
+                return
+
+            # Build a set of each parent's possible values
+            parent_values: List[Set[str]] = [set() for _ in range(num_parents)]
+            value_to_parent_paths = node_obj.value_to_parent_paths
+            for value in values:
+                for path in value_to_parent_paths.get(value, ()):
+                    for n, parent_value in enumerate(path):
+                        parent_values[n].add(parent_value)
+
+            # Update all_parents with the intersection of this node's parents
+            for n, parents in enumerate(parent_values):
+                parent_name = parent_names[n]
+                if parent_name not in all_parents:
+                    all_parents[parent_name] = parents
+                else:
+                    all_parents[parent_name] = all_parents[parent_name].intersection(parents)
 
-        # No parents exist, nothing to do
-        if not num_parents:
-            return
+            # Continue to earlier parents if needed
+            if parent_names[0] == first_node_name:
+                return
+            node, values = parent_names[0], parent_values[0]
 
-        # Build a set of each parent's possible values
-        parent_values: List[Set[str]] = [set() for _ in range(num_parents)]
-        for value in values:
-            collect_parents(
-                node_obj.probabilities,
-                value,
-                parent_values=parent_values,
-            )
 
-        # Update all_parents with the intersection of this node's parents
-        for n, parents in enumerate(parent_values):
-            parent_name = parent_names[n]
-            if parent_name not in all_parents:
-                all_parents[parent_name] = parents
-            else:
-                all_parents[parent_name] = all_parents[parent_name].intersection(parents)
+def collect_parent_paths(
+    probabilities: Mapping[str, Any], depth: int
+) -> Dict[str, List[Tuple[str, ...]]]:
+    """
+    Collects the parent value paths that lead to each value of a node.
+    `depth` is the number of parents (the depth of the leaf rows in the CPT).
+    """
+    # Walk the CPT level by level, keeping each row with its parent value path
+    rows: List[Tuple[Tuple[str, ...], Mapping[str, Any]]] = [((), probabilities)]
+    for _ in range(depth):
+        rows = [(path + (parent,), row) for path, level in rows for parent, row in level.items()]
 
-        # Recurse to earlier parents if needed
-        if parent_names and parent_names[0] != self.nodes_in_sampling_order[0].name:
-            self._intersect_parents(
-                node=parent_names[0], values=parent_values[0], all_parents=all_parents
-            )
+    value_to_parent_paths: Dict[str, List[Tuple[str, ...]]] = {}
+    for path, row in rows:
+        for value in row:
+            value_to_parent_paths.setdefault(value, []).append(path)
+    return value_to_parent_paths
 
 
-def collect_parents(
-    probabilities: Mapping[str, Any],
-    target: str,
-    parent_values: List[Set[str]],
-    so_far: Optional[List[str]] = None,
-    depth: int = 0,
-) -> None:
+def filter_distribution(
+    distribution: Mapping[str, float], allowed_values: Container[str]
+) -> Tuple[Dict[str, float], float]:
     """
-    Collects all the possible parent values of a node
+    Filters a distribution to the allowed values, returning it with its total probability
     """
-    if so_far is None:
-        so_far = []
-    for parent, values in probabilities.items():
-        if isinstance(values, dict):
-            collect_parents(
-                probabilities=values,
-                target=target,
-                parent_values=parent_values,
-                so_far=so_far + [parent],
-                depth=depth + 1,
-            )
-        elif parent == target:
-            for n, parent in enumerate(so_far):
-                parent_values[n].add(parent)
+    filtered_dist: Dict[str, float] = {}
+    total = 0.0
+    for value, prob in distribution.items():
+        if value in allowed_values:
+            filtered_dist[value] = prob
+            total += prob
+    return filtered_dist, total
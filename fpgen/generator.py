@@ -8,12 +8,13 @@ from .utils import (
     NETWORK,
     _assert_dict_xor_kwargs,
     _assert_network_exists,
-    _find_roots,
+    _find_target_roots,
     _make_output_dict,
     _maybe_flatten,
     _reassemble_targets,
     _tupilize,
     build_evidence,
+    relax_evidence,
 )
 
 
@@ -42,6 +43,8 @@ class Generator:
             **conditions_kwargs: Conditions for the generated fingerprint (passed as kwargs)
         """
         _assert_dict_xor_kwargs(conditions, conditions_kwargs)
+        # The network is loaded once at import, so checking here covers generate()
+        _assert_network_exists()
         # Set default options
         self.strict: bool = strict
         self.flatten: bool = flatten
@@ -98,24 +101,27 @@ class Generator:
             A generated fingerprint.
         """
         _assert_dict_xor_kwargs(conditions, conditions_kwargs)
-        _assert_network_exists()
 
         if conditions_kwargs:
             conditions = conditions_kwargs
 
         # Merge new options with old
-        strict = _first(strict, self.strict)
-        flatten = _first(flatten, self.flatten)
-
-        # Inherit the evidence from the class instance
-        evidence = self.evidence.copy()
+        if strict is None:
+            strict = self.strict
+        if flatten is None:
+            flatten = self.flatten
+
+        # Inherit the evidence from the class instance.
+        # It's only copied if it will be modified.
+        evidence = self.evidence
         if conditions:
+            evidence = evidence.copy()
             build_evidence(conditions, evidence, strict=strict)
 
         # Convert targets to set
         if target:
             target_tup = _tupilize(target)
-            target_roots = set(_find_roots(target_tup))
+            target_roots = set(_find_target_roots(tuple(target_tup)))
         else:
             target_roots = None
 
@@ -136,12 +142,14 @@ class Generator:
                     'Cannot generate fingerprint. Constraints are too restrictive.'
                 )
             # If no fingerprint was generated, relax the filtered values until we find one
-            evidence.pop(next(iter(evidence.keys())))
+            if evidence is self.evidence:
+                evidence = evidence.copy()
+            relax_evidence(evidence)
 
         # If we arent searching for certain targets, we can return right away
         if target:
             output = _make_output_dict(fingerprint, flatten=False)  # Don't flatten yet
-            output = _reassemble_targets(_tupilize(target), output)
+            output = _reassemble_targets(target_tup, output)
             if isinstance(target, str):
                 output = output[target]
             return _maybe_flatten(flatten, output)
@@ -206,13 +214,6 @@ class Generator:
         )
 
 
-def _first(*values):
-    """
-    Simple function that returns the first non-None value passed
-    """
-    return next((v for v in values if v is not None), None)
-
-
 """
 A global `generate` function for those calling
 fpgen.generate() directly without creating a Generator object
@@ -249,4 +250,4 @@ def generate_target(target: str, conditions: Optional[Dict[str, Any]] = None, **
     return generate(target=target, conditions=conditions, **kwargs)
 
 
-__all__ = ('Generator', 'WindowBounds', 'generate', 'generate_target')
+__all__ = ('Generator', 'generate', 'generate_target')
@@ -1,9 +1,14 @@
+import io
+import mmap
 import os
+import tarfile
 import tempfile
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import click
 import httpx
@@ -26,6 +31,16 @@ FILE_PAIRS = {
     VALUES_DATA: VALUES_DATA.with_suffix('.dat.zst'),
 }
 
+# ETag & asset of the last release listing, used for conditional requests
+RELEASES_CACHE = DATA_DIR / '.releases.json'
+
+# Buffer size used when streaming model files through zstd
+STREAM_BUFFER_SIZE = 1 << 20
+# Compression level & window size (log2) used when recompressing the model.
+# Capping the window bounds the memory needed to decompress it again.
+COMPRESSION_LEVEL = 19
+COMPRESSION_WINDOW_LOG = 20
+
 # Repo to pull releases from
 GITHUB_REPO = 'scrapfly/fingerprint-generator'
 
@@ -37,6 +52,20 @@ class ModelPuller:
 
     def __init__(self) -> None:
         self.api_url = f"https://api.github.com/repos/{GITHUB_REPO}/releases"
+        # Shared by the API lookup & asset download so connections get reused
+        self.client = httpx.Client(timeout=20, follow_redirects=True)
+
+    def close(self) -> None:
+        """
+        Close the underlying HTTP client.
+        """
+        self.client.close()
+
+    def __enter__(self) -> 'ModelPuller':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     def check_asset(self, asset: Dict) -> Any:
         """
@@ -49,7 +78,7 @@ class ModelPuller:
             Any: Data to be returned if this is the desired asset, or None/False if not
         """
         url = asset.get('browser_download_url')
-        if url and url.endswith('.zip'):
+        if url and url.endswith(('.zip', '.tar.zst')):
             return url
 
     def missing_asset_error(self) -> None:
@@ -63,18 +92,51 @@ class ModelPuller:
         Fetch the latest release from the GitHub API.
         Gets the first asset that returns a truthy value from check_asset.
         """
-        resp = httpx.get(self.api_url, timeout=20, verify=False)
+        # Only ask for the listing if it changed since the last lookup
+        cached = self.read_release_cache()
+        headers = {'If-None-Match': cached['etag']} if cached else None
+
+        resp = self.client.get(self.api_url, headers=headers)
+        if cached and resp.status_code == 304:
+            return cached['asset']
         resp.raise_for_status()
 
-        releases = resp.json()
+        releases = orjson.loads(resp.content)
 
         for release in releases:
             for asset in release['assets']:
                 if data := self.check_asset(asset):
+                    self.write_release_cache(resp.headers.get('ETag'), data)
                     return data
 
         self.missing_asset_error()
 
+    def read_release_cache(self) -> Optional[Dict]:
+        """
+        Returns the cached ETag & asset for this API url, if any
+        """
+        try:
+            with open(RELEASES_CACHE, 'rb') as f:
+                cached = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        if isinstance(cached, dict) and cached.get('url') == self.api_url and cached.get('etag'):
+            return cached
+        return None
+
+    def write_release_cache(self, etag: Optional[str], asset: Any) -> None:
+        """
+        Saves the ETag & asset of the release listing
+        """
+        if not etag:
+            return
+        try:
+            data = orjson.dumps({'url': self.api_url, 'etag': etag, 'asset': asset})
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            RELEASES_CACHE.write_bytes(data)
+        except (OSError, TypeError):
+            pass  # Not cacheable, the listing is just fetched again next time
+
     def download(self):
         """
         Download the model from GitHub and extract it to the data directory.
@@ -93,22 +155,88 @@ class ModelPuller:
         if password:
             password = password.encode()
 
-        # Stream to tempfile then extract using zipfile
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            with httpx.stream(
-                'GET', url, timeout=20, verify=False, follow_redirects=True
-            ) as r:  # nosec
-                for chunk in r.iter_bytes():
+        # zstd tarballs are extracted as they download
+        if httpx.URL(url).path.endswith('.tar.zst'):
+            if password:
+                raise ValueError('FPGEN_MODEL_PASSWORD is only supported for .zip models')
+            self.extract_tar_zst(url)
+            return
+
+        # Zips keep their directory at the end, so stream to an anonymous tempfile,
+        # then extract using zipfile
+        with tempfile.TemporaryFile() as temp_file:
+            with self.client.stream('GET', url) as r:
+                r.raise_for_status()
+                for chunk in r.iter_bytes(STREAM_BUFFER_SIZE):
                     temp_file.write(chunk)
-                temp_file.flush()
-            temp_file.close()
+            temp_file.seek(0)
             # Print extraction message if running as module
             if __is_module__():
                 click.echo(f"Extracting to {DATA_DIR}...")
-            with zipfile.ZipFile(temp_file.name) as z:
+            with zipfile.ZipFile(temp_file) as z:
                 z.extractall(DATA_DIR, pwd=password)
 
-            os.unlink(temp_file.name)
+    def extract_tar_zst(self, url: str) -> None:
+        """
+        Stream a .tar.zst asset through zstd and tarfile into the data directory.
+        """
+        if __is_module__():
+            click.echo(f"Extracting to {DATA_DIR}...")
+        dctx = zstandard.ZstdDecompressor()
+        with self.client.stream('GET', url) as r:
+            r.raise_for_status()
+            chunks = r.iter_bytes(STREAM_BUFFER_SIZE)
+            raw = io.BufferedReader(_IterReader(chunks), STREAM_BUFFER_SIZE)
+            with dctx.stream_reader(raw, read_size=STREAM_BUFFER_SIZE) as reader:
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    # Stamp files with the extraction time (like zipfile does),
+                    # so the archive's own mtimes don't make them look outdated
+                    now = time.time()
+                    for member in tar:
+                        _check_tar_member(member)
+                        member.mtime = now
+                        if hasattr(tarfile, 'data_filter'):
+                            tar.extract(member, DATA_DIR, filter='data')
+                        else:
+                            tar.extract(member, DATA_DIR)  # nosec - checked above
+
+
+def _check_tar_member(member: tarfile.TarInfo) -> None:
+    """
+    Rejects tar members that could write outside of DATA_DIR.
+    Only plain files & directories with relative paths are allowed.
+    """
+    name = member.name.replace('\\', '/')
+    if not (member.isfile() or member.isdir()):
+        raise ValueError(f'Unsupported member type in model archive: {member.name}')
+    if name.startswith('/') or os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        raise ValueError(f'Absolute path in model archive: {member.name}')
+    if '..' in name.split('/'):
+        raise ValueError(f'Path traversal in model archive: {member.name}')
+
+
+class _IterReader(io.RawIOBase):
+    """
+    Read-only file object over an iterator of bytes chunks
+    """
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
 
 
 """
@@ -127,9 +255,14 @@ def extract_json(path: Path) -> dict:
 
     # Check for zst json
     elif (zst_path := path.with_suffix('.json.zst')).exists():
-        with open(zst_path, 'rb') as f:
-            decomp = zstandard.ZstdDecompressor()
-            return orjson.loads(decomp.decompress(f.read()))
+        decomp = zstandard.ZstdDecompressor()
+        # Map the compressed file instead of reading it into memory.
+        # This keeps peak memory to roughly the size of the decompressed JSON.
+        with open(zst_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Frames written without a content size can't be decompressed in one shot
+            if zstandard.frame_content_size(data) == -1:
+                return orjson.loads(decomp.stream_reader(data).read())
+            return orjson.loads(decomp.decompress(data))
 
     raise FileNotFoundError(f'Missing required data file for: {path}')
 
@@ -143,7 +276,8 @@ def download_model():
     """
     Call the model puller to download files
     """
-    ModelPuller().download()
+    with ModelPuller() as puller:
+        puller.download()
 
 
 def decompress_model():
@@ -152,16 +286,23 @@ def decompress_model():
     """
     import zstandard
 
-    dctx = zstandard.ZstdDecompressor()
+    def decompress_file(src_zst: Path, dst: Path) -> None:
+        # Decompression contexts aren't thread safe, so each file gets its own
+        dctx = zstandard.ZstdDecompressor()
+        click.echo(f"Decompressing {src_zst} -> {dst}")
+        with open(src_zst, 'rb') as src, open(dst, 'wb') as dst_f:
+            dctx.copy_stream(
+                src, dst_f, read_size=STREAM_BUFFER_SIZE, write_size=STREAM_BUFFER_SIZE
+            )
+        src_zst.unlink()
+
+    jobs = []
     for src_zst, dst in {v: k for k, v in FILE_PAIRS.items()}.items():
         if not src_zst.exists():
             click.echo(f"Warning: {src_zst} not found, skipping")
             continue
-
-        click.echo(f"Decompressing {src_zst} -> {dst}")
-        with open(src_zst, 'rb') as src, open(dst, 'wb') as dst_f:
-            dctx.copy_stream(src, dst_f)
-        src_zst.unlink()
+        jobs.append((src_zst, dst))
+    _run_file_jobs(decompress_file, jobs)
 
 
 def recompress_model():
@@ -170,19 +311,46 @@ def recompress_model():
     """
     import zstandard
 
-    cctx = zstandard.ZstdCompressor(level=19)
+    params = zstandard.ZstdCompressionParameters.from_level(
+        COMPRESSION_LEVEL, window_log=COMPRESSION_WINDOW_LOG, threads=-1
+    )
+
+    def compress_file(src: Path, dst_zst: Path) -> None:
+        # Compression contexts aren't thread safe, so each file gets its own
+        cctx = zstandard.ZstdCompressor(compression_params=params)
+        click.echo(f"Compressing {src} -> {dst_zst}")
+        with open(src, 'rb') as src_f, open(dst_zst, 'wb') as dst_f:
+            # Pass the source size so the frame header still records the content size
+            cctx.copy_stream(
+                src_f,
+                dst_f,
+                size=src.stat().st_size,
+                read_size=STREAM_BUFFER_SIZE,
+                write_size=STREAM_BUFFER_SIZE,
+            )
+        src.unlink()
+
+    jobs = []
     for src, dst_zst in FILE_PAIRS.items():
         if not src.exists():
             click.echo(f"Warning: {src} not found, skipping")
             continue
+        jobs.append((src, dst_zst))
+    _run_file_jobs(compress_file, jobs)
 
-        click.echo(f"Compressing {src} -> {dst_zst}")
-        with open(src, 'rb') as src_f:
-            data = src_f.read()
-            compressed = cctx.compress(data)
-            with open(dst_zst, 'wb') as dst:
-                dst.write(compressed)
-        src.unlink()
+
+def _run_file_jobs(func: Callable[[Path, Path], None], jobs: List[Tuple[Path, Path]]) -> None:
+    """
+    Runs a (de)compression job for each file pair in parallel.
+    zstd releases the GIL, so threads are enough here.
+    """
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [executor.submit(func, *job) for job in jobs]
+        # Raise the first error, if any
+        for future in futures:
+            future.result()
 
 
 def remove_model(log=True):
@@ -205,8 +373,8 @@ def files_are_recent(file_list):
     """
     Checks if all passed files are <5 weeks old
     """
-    cutoff = datetime.now() - timedelta(weeks=5)
-    return all(datetime.fromtimestamp(f.stat().st_mtime) >= cutoff for f in file_list)
+    cutoff = (datetime.now() - timedelta(weeks=5)).timestamp()
+    return all(f.stat().st_mtime >= cutoff for f in file_list)
 
 
 def assert_downloaded():
@@ -220,7 +388,7 @@ def assert_downloaded():
     if all(file.exists() for file in FILE_PAIRS.keys()):
         # When updating decompressed files, decompress again after redownloading
         if not files_are_recent(FILE_PAIRS.keys()):
-            ModelPuller().download()
+            download_model()
             decompress_model()
         return
 
@@ -229,7 +397,7 @@ def assert_downloaded():
         return
 
     # First time importing
-    ModelPuller().download()
+    download_model()
 
 
 def __is_module__() -> bool:
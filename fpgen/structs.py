@@ -5,8 +5,11 @@ class CaseInsensitiveDict(dict):
         return key.casefold() if isinstance(key, str) else key
 
     def __init__(self, *args, **kwargs):
-        super(CaseInsensitiveDict, self).__init__(*args, **kwargs)
-        self._convert_keys()
+        # Casefold the keys while building, rather than re-inserting each one after
+        _k = self.__class__._k
+        super(CaseInsensitiveDict, self).__init__(
+            {_k(k): v for k, v in dict(*args, **kwargs).items()}
+        )
 
     def __getitem__(self, key):
         return super(CaseInsensitiveDict, self).__getitem__(self.__class__._k(key))
@@ -35,8 +38,3 @@ class CaseInsensitiveDict(dict):
     def update(self, E={}, **F):
         super(CaseInsensitiveDict, self).update(self.__class__(E))
         super(CaseInsensitiveDict, self).update(self.__class__(**F))
-
-    def _convert_keys(self):
-        for k in list(self.keys()):
-            v = super(CaseInsensitiveDict, self).pop(k)
-            self.__setitem__(k, v)
@@ -9,7 +9,7 @@ from .unpacker import lookup_value_list
 from .utils import (
     NETWORK,
     _assert_dict_xor_kwargs,
-    _find_roots,
+    _find_target_roots,
     _tupilize,
     build_evidence,
 )
@@ -81,7 +81,7 @@ def trace(
 
     # Get the targets
     target_tup = _tupilize(target)
-    target_roots = tuple(_find_roots(target_tup))
+    target_roots = _find_target_roots(tuple(target_tup))
 
     # List is empty, raise an error
     if not target_tup:
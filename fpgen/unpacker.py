@@ -1,5 +1,5 @@
 import base64
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import numpy as np
 from indexed_zstd import IndexedZstdFile
@@ -16,6 +16,11 @@ if not __is_module__():
     # Do not attempt to load values.json if we are running as a module
     VALUE_PAIRS = load_values_json()
 
+# Decoded values by lookup index, so repeated lookups skip the data file.
+# Cleared once it grows past VALUE_CACHE_SIZE entries.
+VALUE_CACHE_SIZE = 1 << 16
+_value_cache: Dict[str, str] = {}
+
 
 def base85_to_int(s: str) -> int:
     # Decode using base85
@@ -52,17 +57,28 @@ def lookup_value_list(index_list):
     # Empty numpy array of len(index_list)
     value_map = np.empty(len(index_list), dtype=object)
 
+    # Fill in cached values first
+    cache = _value_cache
+    missing = []
+    for n, lookup_index in enumerate(index_list):
+        value = cache.get(lookup_index)
+        if value is None:
+            missing.append((base85_to_int(lookup_index), n, lookup_index))
+        else:
+            value_map[n] = value
+    if not missing:
+        return value_map
+
+    if len(cache) + len(missing) > VALUE_CACHE_SIZE:
+        cache.clear()
+
     file = get_dat_file()
     # Read in order from lowest index to highest
-    sorted_indices = sorted(
-        (base85_to_int(lookup_index), n) for n, lookup_index in enumerate(index_list)
-    )
-
-    for index, n in sorted_indices:
+    for index, n, lookup_index in sorted(missing):
         offset, length = VALUE_PAIRS[index]
         file.seek(int(offset, 16))
         # Set to key in order of the original list
-        value_map[n] = file.read(length).decode('utf-8')
+        value_map[n] = cache[lookup_index] = file.read(length).decode('utf-8')
 
     file.close()
     return value_map
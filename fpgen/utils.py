@@ -1,7 +1,11 @@
+from bisect import bisect_left
 from collections.abc import MutableMapping
+from functools import lru_cache
+from itertools import chain
 from typing import (
     Any,
     Dict,
+    FrozenSet,
     Iterable,
     Iterator,
     List,
@@ -25,7 +29,6 @@ from .exceptions import (
     RestrictiveConstraints,
 )
 from .pkgman import NETWORK_FILE, __is_module__
-from .structs import CaseInsensitiveDict
 from .unpacker import lookup_value_list
 
 # Load the network. (unless we're running as a module)
@@ -78,9 +81,12 @@ def query(
     if root_data is not None:
         # Read possibile values as jsons
         output = map(orjson.loads, root_data[1])
-        # Pull the item at the target path
-        output = map(lambda d: _at_path(d, nested_keys), output)
-        output = tuple(output)
+        # Pull the item at the target path.
+        # Many values share the same data at the path, so drop exact duplicates early
+        unique: Dict[bytes, Any] = {}
+        for d in map(lambda d: _at_path(d, nested_keys), output):
+            unique.setdefault(orjson.dumps(d, option=orjson.OPT_SORT_KEYS), d)
+        output = tuple(unique.values())
 
         # If they are all dicts, merge them
         if all(isinstance(d, dict) for d in output):
@@ -90,21 +96,26 @@ def query(
         # Return a deduped list
         return _dedupe(output, sort=sort)
 
-    # Search down the tree
-    data = _search_downward(target)
-    resp: Dict[str, List[Any]] = {
+    # Search down the tree, building the output as nodes are found
+    prefix = f'{target}.'
+    resp: Dict[str, Any] = {}
+    for key in _search_downward(target):
+        # Parse each possible value via orjson, and dedupe them
+        values = _dedupe(
+            map(orjson.loads, _lookup_possibilities(key, casefold=False) or tuple()), sort=sort
+        )
         # Remove the current node path
-        key.removeprefix(f'{target}.'): [
-            # Parse each possible value via orjson
-            orjson.loads(d)
-            for d in (_lookup_possibilities(key, casefold=False) or tuple())
-        ]
-        for key in data
-    }
-    if flatten:
-        # May need to flatten further
-        return _flatten({node: _dedupe(values, sort=sort) for node, values in resp.items()})
-    return _unflatten(resp, sort=sort)
+        key = key.removeprefix(prefix)
+        if flatten:
+            resp[key] = values
+            continue
+        # Unflatten the remaining path
+        *parents, leaf = key.split('.')
+        d = resp
+        for part in parents:
+            d = d.setdefault(part, {})
+        d[leaf] = values
+    return resp
 
 
 """
@@ -117,11 +128,22 @@ def _at_path(data: Mapping, path: StrContainer, *, casefold=False) -> Any:
     Gets the value in nested dictionary given its path
     """
     for key in path:
-        if casefold:
-            data = CaseInsensitiveDict(data)
-        if not isinstance(data, MutableMapping) or key not in data:
+        # Parsed JSON is always a plain dict, so skip the ABC check for it
+        if type(data) is not dict and not isinstance(data, MutableMapping):
+            raise NodePathError(key)
+        if key in data:
+            data = data[key]
+            continue
+        if not casefold:
+            raise NodePathError(key)
+        # Match the key case-insensitively without copying the dict
+        folded_key = key.casefold()
+        for data_key in data:
+            if isinstance(data_key, str) and data_key.casefold() == folded_key:
+                data = data[data_key]
+                break
+        else:
             raise NodePathError(key)
-        data = data[key]
     return data
 
 
@@ -154,44 +176,62 @@ def _lookup_root_possibilities(
     """
     if not key:
         raise InvalidNode('Key cannot be empty.')
-    while key:
+
+    root = _find_root_node(key)
+    if root is None:
+        if none_if_missing:
+            return None
+        raise InvalidNode(f'{key.split(".", 1)[0]} is not a valid node')
+    key, root_nested_keys = root
+
+    if nested_keys is not None:
+        nested_keys.extend(root_nested_keys)
+
+    return key, _lookup_possibilities(key, casefold)  # type: ignore
+
+
+@lru_cache(maxsize=128)
+def _find_root_node(key: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    Finds the first avaliable root node of a given key.
+    Returns the root's key and the nested keys below it, or None if there is none.
+    """
+    nested_keys: List[str] = []
+    while True:
         keys = key.rsplit('.', 1)
         # Ran out of keys to parse
         if len(keys) != 2:
-            if none_if_missing:
-                return None
-            raise InvalidNode(f'{key} is not a valid node')
+            return None
         key, sliced_key = keys
+        nested_keys.append(sliced_key)
 
-        if nested_keys is not None:
-            nested_keys.append(sliced_key)
-
-        # if a nested key is avaliable, enter it
-        possible_values = _lookup_possibilities(key, casefold)
         # iterate backwards until we find the node
-        if possible_values is not None:
+        if key.casefold() in NETWORK.nodes_by_name:
             break
 
-    if possible_values is None:
-        if none_if_missing:
-            return None
-        raise InvalidNode(f'{key} is not a valid node')
-
-    if nested_keys:
-        nested_keys.reverse()
-
-    return key, possible_values
+    nested_keys.reverse()
+    return key, tuple(nested_keys)
 
 
 def _lookup_possibilities(node_name: str, casefold: bool = True) -> Optional[Dict[str, Any]]:
     """
     Returns the possible values for the given node name.
     Returns as a dictionary {value: lookup_index}
+    The result is cached, so callers must not mutate it.
     """
-    if node_name not in NETWORK.nodes_by_name:
+    node = NETWORK.nodes_by_name.get(node_name.casefold())
+    if node is None:
         return None
+    # Cache by the node's real name, so user input can't grow the cache
+    return _node_possibilities(node.name, casefold)
+
 
-    lookup_values = NETWORK.nodes_by_name[node_name].possible_values
+@lru_cache(maxsize=None)
+def _node_possibilities(node_name: str, casefold: bool) -> Dict[str, Any]:
+    """
+    Builds the {value: lookup_index} dict for a node, by its real name
+    """
+    lookup_values = NETWORK.nodes_by_name[node_name.casefold()].possible_values
     actual_values = lookup_value_list(lookup_values)
 
     return {
@@ -200,26 +240,76 @@ def _lookup_possibilities(node_name: str, casefold: bool = True) -> Optional[Dic
     }
 
 
+@lru_cache(maxsize=None)
+def _parsed_possibilities(node_name: str) -> Tuple[Tuple[Any, str], ...]:
+    """
+    Returns the parsed (casefolded) possible values for the given node name.
+    Returns as a tuple of (parsed value, lookup_index) pairs.
+    Parsing is done once per node, so callers must not mutate the values.
+    """
+    possible_values = _lookup_possibilities(node_name) or {}
+    return tuple(
+        (orjson.loads(value), lookup_index) for value, lookup_index in possible_values.items()
+    )
+
+
+def _copy_json(value: Any) -> Any:
+    """
+    Copies parsed JSON data, so user callables can't mutate cached values
+    """
+    if isinstance(value, (dict, list)):
+        return orjson.loads(orjson.dumps(value))
+    return value
+
+
+# Keyed by paths from user conditions, so keep it bounded
+@lru_cache(maxsize=128)
+def _nested_value_index(
+    node_name: str, nested_keys: Tuple[str, ...]
+) -> Tuple[Dict[Any, List[str]], List[Tuple[Any, str]]]:
+    """
+    Indexes a node's possible values by the (casefolded) value at a nested path.
+    Returns a dict of {hashable value: [lookup_index, ...]},
+    and a list of (unhashable value, lookup_index) pairs.
+    """
+    index: Dict[Any, List[str]] = {}
+    unhashable: List[Tuple[Any, str]] = []
+    for outputted_possible, lookup_index in _parsed_possibilities(node_name):
+        try:
+            target_value = _at_path(outputted_possible, nested_keys)
+        except NodePathError:
+            continue  # Path didn't exist, bad data
+        if isinstance(target_value, (dict, list)):
+            unhashable.append((target_value, lookup_index))
+        else:
+            index.setdefault(target_value, []).append(lookup_index)
+    return index, unhashable
+
+
 def _search_downward(domain: str) -> Iterable[str]:
     """
     Searches for all nodes that begin with a specific key
     """
-    found = False
-    for i, node in enumerate(NETWORK.nodes_by_name.keys()):
+    # Names starting with the domain are next to each other in the sorted list
+    sorted_names = NETWORK._sorted_node_names
+    key_len = len(domain)
+    indexes = []
+    for n in range(bisect_left(sorted_names, domain), len(sorted_names)):
+        node = sorted_names[n]
         if not node.startswith(domain):
-            continue
+            break
         # Check if its a . afterward
-        key_len = len(domain)
         if len(node) > key_len and node[key_len] != '.':
             continue
-        if not found:
-            found = True
-        # Get the original case
-        yield NETWORK.node_names[i]
+        indexes.append(NETWORK.nodes_by_name[node].index)
 
-    if not found:
+    if not indexes:
         raise InvalidNode(f'Unknown node: "{domain}"')
 
+    # Yield the original case, in sampling order
+    for index in sorted(indexes):
+        yield NETWORK.node_names[index]
+
 
 def _find_roots(targets: Union[str, StrContainer]) -> Iterator[str]:
     """
@@ -245,6 +335,14 @@ def _find_roots(targets: Union[str, StrContainer]) -> Iterator[str]:
             break
 
 
+@lru_cache(maxsize=128)
+def _find_target_roots(targets: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    Cached list of the nodes that make up the given targets' data
+    """
+    return tuple(_find_roots(targets))
+
+
 def _reassemble_targets(targets: StrContainer, fingerprint: Dict[str, Any]):
     result = {}
     for target in targets:
@@ -265,19 +363,23 @@ def _dedupe(lst: Iterable[Any], sort: bool) -> List[Any]:
     """
     Group items by their type, deduping each group
     """
-    groups: Dict[type, Any] = {}
+    groups: Dict[type, Dict[Any, Any]] = {}
     for item in lst:
         t = type(item)
-        if t not in groups:
-            groups[t] = []
-        # Only add item if it's not already in its type group
-        if item not in groups[t]:
-            groups[t].append(item)
+        group = groups.get(t)
+        if group is None:
+            group = groups[t] = {}
+        # Only add item if it's not already in its type group.
+        # Unhashable items are keyed by their JSON encoding
+        if t is dict or t is list:
+            group.setdefault(orjson.dumps(item, option=orjson.OPT_SORT_KEYS), item)
+        else:
+            group.setdefault(item, item)
 
     result = []
     # Process groups in order sorted by type name
     for t in sorted(groups.keys(), key=lambda typ: typ.__name__):
-        items = groups[t]
+        items = groups[t].values()
         # Do not sort if `sort` is False, or if type is unhashable
         if not sort or t in (list, dict):
             result.extend(items)
@@ -286,25 +388,6 @@ def _dedupe(lst: Iterable[Any], sort: bool) -> List[Any]:
     return result
 
 
-def _unflatten(dictionary, sort: bool) -> Dict[str, Any]:
-    """
-    Unflatten dicts and dedupe any nested lists
-    """
-    result_dict: Dict[str, Any] = dict()
-    for key, value in dictionary.items():
-        parts = key.split(".")
-        d = result_dict
-        for part in parts[:-1]:
-            if part not in d:
-                d[part] = dict()
-            d = d[part]
-        # Dedupe lists
-        if isinstance(value, list):
-            value = _dedupe(value, sort=sort)
-        d[parts[-1]] = value
-    return result_dict
-
-
 def _flatten(dictionary: Dict[str, Any], parent_key=False) -> Dict[str, Any]:
     """
     Turn a nested dictionary into a flattened dictionary
@@ -338,25 +421,25 @@ def _merge_dicts(dict_list: Iterable[Dict[str, Any]], sort: bool) -> Dict[str, A
     if not dict_list:
         return {}
 
-    merged: Dict[str, Any] = {}
-    # Get the union of keys from all dictionaries.
-    all_keys: Set[str] = set()
+    # Collect the values of each key in one pass over the dicts.
+    # Dicts that don't have a key are skipped for it.
+    values_by_key: Dict[str, List[Any]] = {}
     for d in dict_list:
-        all_keys.update(d.keys())
-
-    for key in all_keys:
-        # Get the list of values for the current key, skipping dicts that don't have it
-        values = [d[key] for d in dict_list if key in d]
+        for key, value in d.items():
+            values = values_by_key.get(key)
+            if values is None:
+                values_by_key[key] = [value]
+            else:
+                values.append(value)
 
+    merged: Dict[str, Any] = {}
+    for key, values in values_by_key.items():
         if all(isinstance(v, dict) for v in values):
             # Merge dictionaries recursively
             merged[key] = _merge_dicts(values, sort=sort)
         elif all(isinstance(v, list) for v in values):
             # Merge lists
-            merged_list = []
-            for lst in values:
-                merged_list.extend(lst)
-            merged[key] = _dedupe(merged_list, sort=sort)
+            merged[key] = _dedupe(chain.from_iterable(values), sort=sort)
         else:
             # For mixed/scalar values, dedupe
             merged[key] = _dedupe(values, sort=sort)
@@ -377,18 +460,23 @@ Parse user input
 
 
 def _flatten_conditions(
-    dictionary: Mapping[str, Any], parent_key: str = '', casefold: bool = False
+    dictionary: Mapping[str, Any],
+    parent_key: str = '',
+    casefold: bool = False,
+    flattened: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """
     Flattens the passed list of conditions
     """
     # Original flattening logic from here:
     # https://stackoverflow.com/questions/6027558/flatten-nested-dictionaries-compressing-keys
-    items: List[Tuple[str, Any]] = []
+    # Nested calls write straight into the same output dict
+    if flattened is None:
+        flattened = {}
     for key, value in dictionary.items():
         new_key = parent_key + '.' + key if parent_key else key
         if isinstance(value, MutableMapping):
-            items.extend(_flatten_conditions(value, new_key).items())
+            _flatten_conditions(value, new_key, flattened=flattened)
         else:
             # If we have a tuple or set, treat it as an array of possible values
             if isinstance(value, (set, tuple)):
@@ -398,95 +486,121 @@ def _flatten_conditions(
                 value = orjson.dumps(value).decode()
             if casefold:
                 new_key = new_key.casefold()
-            items.append((new_key, value))
-    return dict(items)
+            flattened[new_key] = value
+    return flattened
 
 
-def build_evidence(
-    conditions: Dict[str, Any], evidence: Dict[str, Set[str]], strict: Optional[bool] = None
-) -> None:
+def _resolve_condition(key: str, value: Any) -> Tuple[str, FrozenSet[str]]:
     """
-    Builds evidence based on the user's inputted conditions
+    Resolves a single flattened condition to its node name and allowed lookup indexes
     """
-    if strict is None:
-        strict = True
-
-    # Flatten to match the format of the fingerprint network
-    conditions = _flatten_conditions(conditions, casefold=True)
+    possible_values = _lookup_possibilities(key)
 
-    for key, value in conditions.items():
-        possible_values = _lookup_possibilities(key)
+    # Handle nested keys
+    nested_keys: List[str] = []
+    if possible_values is None:
+        key, possible_values = _lookup_root_possibilities(key, nested_keys)
+    # Get the real name for the key
+    key = NETWORK.nodes_by_name[key.casefold()].name
 
-        # Handle nested keys
-        nested_keys: List[str] = []
-        if possible_values is None:
-            key, possible_values = _lookup_root_possibilities(key, nested_keys)
-        # Get the real name for the key
-        key = NETWORK.nodes_by_name[key].name
+    found_values: Set[str] = set()
 
-        evidence[key] = set()
+    # Casefold the nested path once for all values
+    if nested_keys:
+        nested_keys = [nested_key.casefold() for nested_key in nested_keys]
+        index, unhashable = _nested_value_index(key, tuple(nested_keys))
+
+    for value_con in _tupilize(value):
+        # Read the passed value
+        if callable(value_con):
+            val = value_con  # Callable
+        elif nested_keys:
+            val = orjson.loads(value_con.casefold())  # Dict/list/str data
+        else:
+            val = None  # Plain values are matched by their JSON string below
 
-        for value_con in _tupilize(value):
-            # Read the passed value
-            if callable(value_con):
-                val = value_con  # Callable
+        # Handle nested keys by filtering out possible values that dont
+        # match the value at the target
+        if nested_keys:
+            if callable(val):
+                # Check each possible value at the nested path
+                for target_value, lookup_indexes in index.items():
+                    if val(target_value):
+                        found_values.update(lookup_indexes)
+                for target_value, lookup_index in unhashable:
+                    if val(_copy_json(target_value)):
+                        found_values.add(lookup_index)
+            elif isinstance(val, (dict, list)):
+                # Dicts & lists can only be compared one by one
+                for target_value, lookup_index in unhashable:
+                    if target_value == val:
+                        found_values.add(lookup_index)
             else:
-                val = orjson.loads(value_con.casefold())  # Dict/list/str data
-
-            # Handle nested keys by filtering out possible values that dont
-            # match the value at the target
-            if nested_keys:
-                nested_keys = list(map(lambda s: s.casefold(), nested_keys))
-                for poss_value, lookup_index in possible_values.items():
-                    # Parse the dictionary
-                    outputted_possible = orjson.loads(poss_value)
-
-                    # Check if the value is a possible value at the nested path
-                    try:
-                        target_value = _at_path(outputted_possible, nested_keys)
-                    except NodePathError:
-                        continue  # Path didn't exist, bad data
-                    if callable(val) and val(target_value):
-                        evidence[key].add(lookup_index)
-                    elif target_value == val:
-                        evidence[key].add(lookup_index)
-
-                # If nothing was found, raise an error
-                if not evidence[key]:
-                    if callable(val):
-                        # Callable didnt work
-                        raise InvalidConstraints(
-                            f'The passed function ({val}) yielded no possible values for "{key}" '
-                            f'at "{".".join(nested_keys)}"'
-                        )
+                found_values.update(index.get(val, ()))
+
+            # If nothing was found, raise an error
+            if not found_values:
+                if callable(val):
+                    # Callable didnt work
                     raise InvalidConstraints(
-                        f'{value_con} is not a possible value for "{key}" '
+                        f'The passed function ({val}) yielded no possible values for "{key}" '
                         f'at "{".".join(nested_keys)}"'
                     )
-                continue
+                raise InvalidConstraints(
+                    f'{value_con} is not a possible value for "{key}" '
+                    f'at "{".".join(nested_keys)}"'
+                )
+            continue
 
-            # ===== NON NESTED VALUE HANDLING =====
+        # ===== NON NESTED VALUE HANDLING =====
+
+        # If callable, get all possible values then check for matches
+        if callable(val):
+            # Filter by val(x)
+            found = False
+            for possible_val, lookup_index in _parsed_possibilities(key):
+                if val(_copy_json(possible_val)):
+                    found_values.add(lookup_index)
+                    found = True
+            if not found:
+                raise InvalidConstraints(
+                    f'The passed function ({val}) yielded no possible values for "{key}"'
+                )
+            continue
 
-            # If callable, get all possible values then check for matches
-            if callable(val):
-                # Filter by val(x)
-                found = False
-                for possible_val, lookup_index in possible_values.items():
-                    if val(orjson.loads(possible_val)):
-                        evidence[key].add(lookup_index)
-                        found = True
-                if not found:
-                    raise InvalidConstraints(
-                        f'The passed function ({val}) yielded no possible values for "{key}"'
-                    )
-                continue
+        # Non nested values can be handled by directly checking possible_values
+        lookup_index = possible_values.get(value_con.casefold())
+        # Value is not possible
+        if lookup_index is None:
+            raise InvalidConstraints(f'{value_con} is not a possible value for "{key}"')
+        found_values.add(lookup_index)
+
+    return key, frozenset(found_values)
+
+
+# Generators are often called repeatedly with the same conditions
+_resolve_condition_cached = lru_cache(maxsize=128)(_resolve_condition)
+
+
+def build_evidence(
+    conditions: Dict[str, Any], evidence: Dict[str, Set[str]], strict: Optional[bool] = None
+) -> None:
+    """
+    Builds evidence based on the user's inputted conditions
+    """
+    if strict is None:
+        strict = True
 
-            # Non nested values can be handled by directly checking possible_values
-            lookup_index = possible_values.get(value_con.casefold())
-            # Value is not possible
-            if lookup_index is None:
-                raise InvalidConstraints(f'{value_con} is not a possible value for "{key}"')
-            evidence[key].add(lookup_index)
+    # Flatten to match the format of the fingerprint network
+    conditions = _flatten_conditions(conditions, casefold=True)
+
+    for key, value in conditions.items():
+        # Callables may not be pure, so only cache plain values
+        if any(callable(v) for v in _tupilize(value)):
+            key, found_values = _resolve_condition(key, value)
+        else:
+            key, found_values = _resolve_condition_cached(key, value)
+        evidence[key] = set(found_values)
 
     # Validate the evidence is possible (or try to relax the evidence if strict is False)
     while True:
@@ -495,11 +609,19 @@ def build_evidence(
         except RestrictiveConstraints as e:
             if strict:
                 raise e
-            # Remove the last added key
-            evidence.pop(next(iter(evidence.keys())))
+            relax_evidence(evidence)
+            continue
         break
 
 
+def relax_evidence(evidence: Dict[str, Set[str]]) -> None:
+    """
+    Removes the least restrictive condition (the one allowing the most values).
+    Ties are broken by removing the earliest added condition.
+    """
+    evidence.pop(max(evidence, key=lambda node: len(evidence[node])))
+
+
 def _assert_dict_xor_kwargs(
     passed_dict: Optional[Dict[str, Any]], passed_kwargs: Optional[Dict[str, Any]]
 ) -> None: